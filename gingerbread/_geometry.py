@@ -4,12 +4,14 @@
 
 """Helpers for manipulating, processing, and converting geometry"""
 
+import functools
 import math
 from typing import Iterator
 
 import cssselect2
 import numpy as np
 import svgpathtools
+import svgpathtools.svg_to_paths
 
 
 def bbox_to_rect(xmin, xmax, ymin, ymax) -> tuple[float, float, float, float]:
@@ -25,46 +27,91 @@ def svg_elements_to_paths(
     for elem in svg_elements:
         match elem.local_name:
             case "rect":
-                yield elem, svgpathtools.parse_path(
-                    svgpathtools.svg_to_paths.rect2pathd(elem)
-                )
+                yield elem, _parse_path(svgpathtools.svg_to_paths.rect2pathd(elem))
             case "polygon":
-                yield elem, svgpathtools.parse_path(
-                    svgpathtools.svg_to_paths.polygon2pathd(elem)
-                )
+                yield elem, _parse_path(svgpathtools.svg_to_paths.polygon2pathd(elem))
             case "circle" | "ellipse":
-                yield elem, svgpathtools.parse_path(
-                    svgpathtools.svg_to_paths.ellipse2pathd(elem)
-                )
+                yield elem, _parse_path(svgpathtools.svg_to_paths.ellipse2pathd(elem))
             case "path":
-                yield elem, svgpathtools.parse_path(elem.get("d"))
+                yield elem, _parse_path(elem.etree_element.get("d"))
             case "g":
                 yield from svg_elements_to_paths(elem.iter_children())
             case _:
                 yield elem, None
 
 
-def path_to_points(
-    path: svgpathtools.Path, delta: float = 1
-) -> Iterator[tuple[float, float]]:
-    """Converts an SVG path to a series of points approximating that path"""
+def _parse_path(d: str) -> svgpathtools.Path:
+    # Paths are parsed from their "d" string, which is relatively slow, and
+    # the same string often shows up more than once - repeated shapes, or
+    # the same document converted again. Paths are mutable, so the cache
+    # holds the parsed segments and each caller gets its own Path.
+    return svgpathtools.Path(*_parse_path_segments(d))
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_path_segments(d: str) -> tuple:
+    return tuple(svgpathtools.parse_path(d))
+
+
+def path_to_points(path: svgpathtools.Path, delta: float = 1) -> np.ndarray:
+    """Converts an SVG path to an (N, 2) array of points approximating that
+    path"""
+    # The sampling intervals for all of the path's curves are calculated in
+    # one go up front, which also gives the total number of points so that
+    # the output can be allocated once.
+    beziers = [seg for seg in path if isinstance(seg, svgpathtools.CubicBezier)]
+    controls = _bezier_controls(beziers)
+    intervals = _bezier_intervals(*controls.T, delta=delta)
+    # Each curve's samples, plus its end point.
+    counts = _bezier_sample_count(intervals) + 1
+
+    lines = len(path) - len(beziers)
+    out = np.empty(lines * 2 + counts.sum(), dtype=np.complex128)
+    samples = iter(zip(intervals.tolist(), counts.tolist()))
+    n = 0
+
     for seg in path:
         if isinstance(seg, svgpathtools.Line):
-            yield (seg.start.real, seg.start.imag)
-            yield (seg.end.real, seg.end.imag)
+            out[n] = seg.start
+            out[n + 1] = seg.end
+            n += 2
 
         elif isinstance(seg, svgpathtools.CubicBezier):
-            yield from bezier_to_points(
-                (seg.start.real, seg.start.imag),
-                (seg.control1.real, seg.control1.imag),
-                (seg.control2.real, seg.control2.imag),
-                (seg.end.real, seg.end.imag),
-                delta=delta,
+            interval, count = next(samples)
+            out[n : n + count - 1] = _evaluate_bezier(
+                seg.start, seg.control1, seg.control2, seg.end, interval
             )
+            out[n + count - 1] = seg.end
+            n += count
 
         else:
             raise ValueError(f"Can't convert path segment {seg=}.")
 
+    # Complex values are stored as (real, imag) pairs, so this is a view
+    # rather than a copy.
+    return out.view(np.float64).reshape(-1, 2)
+
+
+def flatten_path(
+    path: svgpathtools.Path, delta: float = 1
+) -> tuple[list[np.ndarray], tuple[float, float, float, float]]:
+    """Converts an SVG path to arrays of points for each of its continuous
+    subpaths, along with the path's bounding box (xmin, xmax, ymin, ymax).
+
+    The bounding box is exact, the same as path.bbox(), rather than just
+    covering the sampled points, which can fall short of a curve's extremes.
+    """
+    subpaths = [
+        path_to_points(subpath, delta=delta) for subpath in path.continuous_subpaths()
+    ]
+    beziers = [seg for seg in path if isinstance(seg, svgpathtools.CubicBezier)]
+    extrema = _bezier_extrema(*_bezier_controls(beziers).T)
+    all_points = np.concatenate(subpaths + [extrema.view(np.float64).reshape(-1, 2)])
+    xmin, ymin = all_points.min(axis=0).tolist()
+    xmax, ymax = all_points.max(axis=0).tolist()
+
+    return subpaths, (xmin, xmax, ymin, ymax)
+
 
 # Ported from https://gitlab.com/kicad/code/kicad/-/blob/2ee65b2d83923acb71aa77ce0efab09a3f2a8f44/bitmap2component/bitmap2component.cpp#L544
 def bezier_to_points(p1, p2, p3, p4, delta=0.25):
@@ -74,30 +121,113 @@ def bezier_to_points(p1, p2, p3, p4, delta=0.25):
     # between the true curve and its approximation does not exceed the
     # desired accuracy delta.
 
+    # Points are handled as complex numbers so that each operation covers
+    # both x and y at once.
+    z1, z2, z3, z4 = complex(*p1), complex(*p2), complex(*p3), complex(*p4)
+
     # dd = maximal value of 2nd derivative over curve - this must occur at an endpoint.
-    dd0 = math.pow(p1[0] - 2 * p2[0] + p3[0], 2) + math.pow(
-        p1[1] - 2 * p2[1] + p3[1], 2
-    )
-    dd1 = math.pow(p2[0] - 2 * p3[0] + p4[0], 2) + math.pow(
-        p2[1] - 2 * p3[1] + p4[1], 2
-    )
-    dd = 6 * math.sqrt(max(dd0, dd1))
+    dd = 6 * max(abs(z1 - 2 * z2 + z3), abs(z2 - 2 * z3 + z4))
     e2 = 8 * delta / dd if 8 * delta <= dd else 1
     interval = math.sqrt(e2)
 
-    for t in np.arange(0, 1, interval):
-        x = (
-            p1[0] * math.pow(1 - t, 3)
-            + 3 * p2[0] * math.pow(1 - t, 2) * t
-            + 3 * p3[0] * (1 - t) * math.pow(t, 2)
-            + p4[0] * math.pow(t, 3)
-        )
-        y = (
-            p1[1] * math.pow(1 - t, 3)
-            + 3 * p2[1] * math.pow(1 - t, 2) * t
-            + 3 * p3[1] * (1 - t) * math.pow(t, 2)
-            + p4[1] * math.pow(t, 3)
-        )
-        yield (x, y)
+    z = _evaluate_bezier(z1, z2, z3, z4, interval)
+
+    yield from zip(z.real.tolist(), z.imag.tolist())
 
     yield p4
+
+
+def sample_beziers(z1, z2, z3, z4, delta=0.25) -> tuple[np.ndarray, np.ndarray]:
+    """Samples many cubic beziers at once, given arrays of their start,
+    control, and end points as complex numbers.
+
+    Returns the samples for all of the curves one after another, along with
+    how many samples each curve has. As with bezier_to_points, each curve's
+    samples start at its start point but don't include its end point.
+    """
+    intervals = _bezier_intervals(z1, z2, z3, z4, delta=delta)
+    counts = _bezier_sample_count(intervals)
+
+    # Works out which curve each sample belongs to and how far along that
+    # curve it is, so that all of the samples can be evaluated together in
+    # the same way as _evaluate_bezier.
+    curve = np.repeat(np.arange(len(counts)), counts)
+    n = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = n * intervals[curve]
+
+    a = -z1 + 3 * z2 - 3 * z3 + z4
+    b = 3 * z1 - 6 * z2 + 3 * z3
+    c = -3 * z1 + 3 * z2
+
+    return ((a[curve] * t + b[curve]) * t + c[curve]) * t + z1[curve], counts
+
+
+def _bezier_controls(beziers: list[svgpathtools.CubicBezier]) -> np.ndarray:
+    # An (n, 4) array of the curves' start, control, and end points.
+    return np.array(
+        [(seg.start, seg.control1, seg.control2, seg.end) for seg in beziers],
+        dtype=np.complex128,
+    ).reshape(-1, 4)
+
+
+def _bezier_extrema(z1, z2, z3, z4) -> np.ndarray:
+    """Returns the points where cubic beziers turn around in x or y, given
+    arrays of their start, control, and end points as complex numbers. End
+    points aren't included."""
+    # The roots of the derivative, a t^2 + b t + c, for x and y separately.
+    a = -z1 + 3 * z2 - 3 * z3 + z4
+    b = 2 * (z1 - 2 * z2 + z3)
+    c = z2 - z1
+
+    roots = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for a, b, c in ((a.real, b.real, c.real), (a.imag, b.imag, c.imag)):
+            # Negative discriminants come out as NaN, which never pass the
+            # range check below, and so do the divisions by zero.
+            root = np.sqrt(b * b - 4 * a * c)
+            roots.append(np.where(a != 0, (-b + root) / (2 * a), -c / b))
+            roots.append(np.where(a != 0, (-b - root) / (2 * a), np.nan))
+
+    t = np.stack(roots)
+    curve = np.broadcast_to(np.arange(len(z1)), t.shape)
+    inside = (t > 0) & (t < 1)
+    t, curve = t[inside], curve[inside]
+
+    z1, z2, z3, z4 = z1[curve], z2[curve], z3[curve], z4[curve]
+    a = -z1 + 3 * z2 - 3 * z3 + z4
+    b = 3 * z1 - 6 * z2 + 3 * z3
+    c = -3 * z1 + 3 * z2
+
+    return ((a * t + b) * t + c) * t + z1
+
+
+def _bezier_intervals(z1, z2, z3, z4, delta):
+    """Same as the interval calculation in bezier_to_points, but for arrays
+    of control points."""
+    # np.hypot gives exactly what abs() does for a complex number, which
+    # np.abs doesn't always, so the points match bezier_to_points'.
+    d1 = z1 - 2 * z2 + z3
+    d2 = z2 - 2 * z3 + z4
+    dd = 6 * np.maximum(np.hypot(d1.real, d1.imag), np.hypot(d2.real, d2.imag))
+
+    # dd can be zero for degenerate curves, which ends up as an interval of 1.
+    with np.errstate(divide="ignore"):
+        return np.sqrt(np.minimum(1, 8 * delta / dd))
+
+
+def _evaluate_bezier(z1, z2, z3, z4, interval) -> np.ndarray:
+    # The curve's polynomial coefficients, evaluated in Horner form.
+    a = -z1 + 3 * z2 - 3 * z3 + z4
+    b = 3 * z1 - 6 * z2 + 3 * z3
+    c = -3 * z1 + 3 * z2
+
+    # Sample at multiples of the interval, with the count fixed up front so
+    # that path_to_points can size its output from the same formula.
+    t = np.arange(_bezier_sample_count(interval)) * interval
+    return ((a * t + b) * t + c) * t + z1
+
+
+def _bezier_sample_count(interval):
+    # The number of samples in [0, 1) for the given interval. Works on both
+    # scalars and arrays.
+    return np.ceil(1 / interval).astype(np.intp)
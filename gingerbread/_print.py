@@ -27,11 +27,19 @@ def set_verbose(v: bool):
     _VERBOSE = v
 
 
+def get_verbose() -> bool:
+    return _VERBOSE
+
+
 def set_timing(t: bool):
     global _TIMING
     _TIMING = t
 
 
+def get_timing() -> bool:
+    return _TIMING
+
+
 def print_(*args, **kwargs):
     previous_frame = inspect.currentframe().f_back.f_back
     module = inspect.getmodule(previous_frame.f_code)
@@ -8,6 +8,7 @@ Note: KiCAD's S-Expression parser *is* position sensitive, so care must be taken
 """
 
 import datetime
+import functools
 import io
 import uuid as _uuid
 from typing import Union
@@ -15,35 +16,41 @@ from typing import Union
 # https://dev-docs.kicad.org/en/file-formats/sexpr-intro/
 
 
+# Escapes for quoted strings, matching what KiCAD's own writer does. See
+# OUTPUTFORMATTER::Quotew in https://gitlab.com/kicad/code/kicad/-/blob/master/common/richio.cpp
+_ESCAPES = str.maketrans(
+    {
+        "\n": "\\n",
+        "\r": "\\r",
+        "\\": "\\\\",
+        '"': '\\"',
+    }
+)
+
+
 def escape_string(s, out: io.TextIOBase):
-    # Based on https://docs.kicad.org/doxygen/string__utils_8cpp.html#ada40aaecc8d7b17fa613cf02bf4da7fb
-    out.write('"')
-    for c in s:
-        match s:
-            case "\n":
-                out.write("\\n")
-            case "\r":
-                out.write("\\r")
-            case "{":
-                out.write("{brace}")
-            case "/":
-                out.write("{slash}")
-            case "\\":
-                out.write("{backlash}")
-            case "<":
-                out.write("{lt}")
-            case ">":
-                out.write("{gt}")
-            case ":":
-                out.write("{colon}")
-            case '"':
-                out.write("{dblqoute}")
-            case _:
-                out.write(c)
-    out.write('"')
+    out.write(f'"{s.translate(_ESCAPES)}"')
+
+
+class _Indents(dict):
+    """Newline and indentation strings for each depth, followed by suffix,
+    built the first time each depth is needed."""
+
+    def __init__(self, suffix=""):
+        self.suffix = suffix
+
+    def __missing__(self, depth):
+        val = self[depth] = "\n" + "  " * depth + self.suffix
+        return val
+
+
+_INDENTS = _Indents()
+_CLOSES = _Indents(")")
 
 
 class Literal:
+    __slots__ = ("val",)
+
     def __init__(self, val):
         self.val = val
 
@@ -52,50 +59,64 @@ L = Literal
 
 
 class Symbol:
+    # Boards are made up of a great many of these, so they're kept as small
+    # as possible.
+    __slots__ = ("token", "attributes")
+
     def __init__(self, token, *attributes):
         self.token = token
-        self.attributes = [x for x in attributes if x is not None]
+        # Most symbols don't have any None attributes to filter out, and
+        # checking for them first is quicker than always filtering.
+        if None in attributes:
+            self.attributes = [x for x in attributes if x is not None]
+        else:
+            self.attributes = list(attributes)
 
     def write(self, out: io.TextIOBase, depth=0):
-        tabbed = False
-        tab = "  " * depth
+        # This is called for every item on a board, so out.write is only
+        # looked up once.
+        write = out.write
 
         if depth:
-            out.write("\n")
-            out.write(tab)
+            write(_INDENTS[depth])
 
         if not self.attributes:
-            out.write(self.token)
+            write(self.token)
             return
 
-        out.write(f"({self.token}")
-
-        for attr in self.attributes:
-            match attr:
-                case Literal():
-                    out.write(attr.val)
-                case S():
-                    if attr.attributes:
-                        tabbed = True
-                        attr.write(out, depth=depth + 1)
-                    else:
-                        out.write(" ")
-                        attr.write(out)
-                case str():
-                    out.write(" ")
-                    escape_string(attr, out)
-                case float():
-                    out.write(f" {attr:0.6f}")
-                case _uuid.UUID():
-                    out.write(" ")
-                    escape_string(str(attr), out)
-                case _:
-                    out.write(f" {attr}")
-
-        if not tabbed:
-            out.write(")")
-        else:
-            out.write(f"\n{tab})")
+        write(f"({self.token}")
+
+        # Boards nest a great many nodes, so instead of recursing into each
+        # child this keeps a stack of [depth, remaining attributes, tabbed]
+        # for the nodes that are still open.
+        stack = [[depth, iter(self.attributes), False]]
+
+        while stack:
+            frame = stack[-1]
+            depth, attributes, _ = frame
+
+            for attr in attributes:
+                cls = type(attr)
+                writer = _WRITERS.get(cls) or _find_writer(cls)
+
+                # Writers return True if they started a new line, or _OPENED
+                # for nodes with attributes of their own, which are written
+                # before this node continues.
+                written = writer(attr, write, depth)
+                if written:
+                    frame[2] = True
+                    if written is _OPENED:
+                        stack.append([depth + 1, iter(attr.attributes), False])
+                        break
+
+            # All of this node's attributes have been written, close it.
+            else:
+                stack.pop()
+
+                if not frame[2]:
+                    write(")")
+                else:
+                    write(_CLOSES[depth])
 
     def __repr__(self) -> str:
         out = io.StringIO()
@@ -109,6 +130,121 @@ class Symbol:
 S = Symbol
 
 
+def _number(val) -> str:
+    # Floats are most of what's written, and %-formatting them is a bit
+    # quicker than an f-string with a format spec.
+    if isinstance(val, float):
+        return " %.6f" % val
+    return " " + str(val)
+
+
+class XY:
+    """Same as S("xy", x, y), which polygons have a great many of, but
+    without the overhead of a Symbol and its attribute list."""
+
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def write(self, out: io.TextIOBase, depth=0):
+        if depth:
+            out.write(_INDENTS[depth])
+        out.write(f"(xy{_number(self.x)}{_number(self.y)})")
+
+    def __repr__(self) -> str:
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def __str__(self) -> str:
+        return self.__repr__()
+
+
+class Points:
+    """A run of xy points given as flat coordinates, x1, y1, x2, y2, ...
+
+    This is for polygons with so many points that even XY adds up. The
+    coordinates must all be floats, and they're all formatted at once.
+    """
+
+    __slots__ = ("coords",)
+
+    def __init__(self, coords):
+        self.coords = tuple(coords)
+
+
+# Attribute writers are given the output's bound write method rather than the
+# output itself, along with the depth of the symbol being written.
+_OPENED = object()
+
+
+def _write_literal(attr, write, depth):
+    write(attr.val)
+
+
+def _write_symbol(attr, write, depth):
+    if attr.attributes:
+        write(f"{_INDENTS[depth + 1]}({attr.token}")
+        return _OPENED
+    write(f" {attr.token}")
+
+
+def _write_xy(attr, write, depth):
+    write(f"{_INDENTS[depth + 1]}(xy{_number(attr.x)}{_number(attr.y)})")
+    return True
+
+
+def _write_points(attr, write, depth):
+    template = f"{_INDENTS[depth + 1]}(xy %.6f %.6f)"
+    write(template * (len(attr.coords) // 2) % attr.coords)
+    return True
+
+
+def _write_str(attr, write, depth):
+    write(f' "{attr.translate(_ESCAPES)}"')
+
+
+def _write_float(attr, write, depth):
+    write(" %.6f" % attr)
+
+
+def _write_uuid(attr, write, depth):
+    write(f' "{attr}"')
+
+
+def _write_other(attr, write, depth):
+    write(" " + str(attr))
+
+
+# Symbol.write looks up how to write each attribute by its exact type, which
+# is much cheaper than a chain of isinstance checks. Subclasses (bool, numpy's
+# float64, etc.) are resolved through the MRO the first time they're seen.
+_WRITERS = {
+    Literal: _write_literal,
+    Symbol: _write_symbol,
+    XY: _write_xy,
+    Points: _write_points,
+    str: _write_str,
+    float: _write_float,
+    _uuid.UUID: _write_uuid,
+    int: _write_other,
+}
+
+
+def _find_writer(cls):
+    for base in cls.__mro__:
+        if base in _WRITERS:
+            writer = _WRITERS[base]
+            break
+    else:
+        writer = _write_other
+
+    _WRITERS[cls] = writer
+    return writer
+
+
 def _opt(name: str, val, *args) -> S | None:
     if val is False or val is None:
         return None
@@ -118,18 +254,32 @@ def _opt(name: str, val, *args) -> S | None:
         return S(name, val, *args)
 
 
+# Symbols are never modified once they're created, so the few that are the
+# same for most items on a board are shared rather than created every time.
+# typed=True keeps width(0) and width(0.0) apart since they're written
+# differently.
+@functools.lru_cache(maxsize=64, typed=True)
 def width(width: float):
     return S("width", width)
 
 
+# Many of the factories below have parameters that shadow helpers like this
+# one, so they call them through aliases instead of looking them up in
+# globals().
+_width = width
+
+
 def at(x: Union[S, float] = 0, y: float = 0, angle: float = None):
     if isinstance(x, S):
         return x
     return S("at", x, y, angle)
 
 
+_at = at
+
+
 def xy(x: float, y: float):
-    return S("xy", x, y)
+    return XY(x, y)
 
 
 def pts(*pts: list[Union[S, tuple[float, float]]]):
@@ -138,8 +288,16 @@ def pts(*pts: list[Union[S, tuple[float, float]]]):
     if isinstance(pts[0], S) and pts[0].token == "pts":
         return pts[0]
 
-    pts = (pt if isinstance(pt, S) else xy(*pt) for pt in pts)
-    return S("pts", *pts)
+    # Polygons can have a great many points, so the list of attributes is
+    # built directly rather than splatted into S() and filtered again.
+    symbol = S("pts")
+    symbol.attributes = [
+        pt if isinstance(pt, (S, XY, Points)) else XY(*pt) for pt in pts
+    ]
+    return symbol
+
+
+_pts = pts
 
 
 def kicad_pcb(
@@ -190,7 +348,6 @@ def setup(
         _opt("solder_mask_min_width", solder_mask_min_width),
         _opt("pad_to_paste_clearance", pad_to_paste_clearance),
         _opt("pad_to_paste_clearance_ratio", pad_to_paste_clearance_ratio),
-        _opt("pad_to_paste_clearance_ratio", pad_to_paste_clearance_ratio),
         aux_axis_origin,
         grid_origin,
         *plot_settings,
@@ -232,19 +389,19 @@ def net(ordinal, name):
 
 def uuid(val: _uuid.UUID = None):
     if val is None:
-        val = _uuid.uuid1()
+        val = _uuid.uuid4()
     return S("uuid", val)
 
 
 def tstamp(val: _uuid.UUID = None):
     if val is None:
-        val = _uuid.uuid1()
+        val = _uuid.uuid4()
     return S("tstamp", val)
 
 
 def tedit(val: _uuid.UUID = None):
     if val is None:
-        val = _uuid.uuid1()
+        val = _uuid.uuid4()
     return S("tedit", val)
 
 
@@ -252,10 +409,15 @@ def layer(*defs: list[str]):
     return S("layer", *defs)
 
 
+@functools.lru_cache(maxsize=64)
+def _layer_symbol(name: str):
+    return S("layer", name)
+
+
 def _layer_or_str(v):
     if isinstance(v, S):
         return v
-    return S("layer", v)
+    return _layer_symbol(v)
 
 
 def attr(
@@ -289,7 +451,7 @@ def footprint(
         library_link,
         _opt("locked", locked),
         layer,
-        globals()["at"](*at),
+        _at(*at),
         attr,
         tstamp(),
         tedit(),
@@ -311,7 +473,7 @@ def fp_text(
         "fp_text",
         S(type),
         text,
-        globals()["at"](*at),
+        _at(*at),
         layer,
         _opt("hide", hide),
         tstamp(),
@@ -333,7 +495,7 @@ def fp_line(
         S("start", *start),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         _opt("locked", locked),
         tstamp(),
     )
@@ -355,15 +517,22 @@ def fp_rect(
         S("start", *start),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         _opt("locked", locked),
-        globals()["fill"](fill),
+        _fill(fill),
         tstamp(),
     )
 
 
+_FILL_SOLID = S("fill", S("solid"))
+_FILL_NONE = S("fill", S("none"))
+
+
 def fill(fill: bool):
-    return S("fill", S("solid" if fill else "none"))
+    return _FILL_SOLID if fill else _FILL_NONE
+
+
+_fill = fill
 
 
 def fp_circle(
@@ -382,9 +551,9 @@ def fp_circle(
         S("center", *center),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         _opt("locked", locked),
-        globals()["fill"](fill),
+        _fill(fill),
         tstamp(),
     )
 
@@ -406,7 +575,7 @@ def fp_arc(
         S("mid", *mid),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         _opt("locked", locked),
         tstamp(),
     )
@@ -424,10 +593,10 @@ def fp_poly(
 
     return S(
         "fp_poly",
-        globals()["pts"](*pts),
+        _pts(*pts),
         layer,
-        globals()["width"](width),
-        globals()["fill"](fill),
+        _width(width),
+        _fill(fill),
         _opt("locked", locked),
         tstamp(),
     )
@@ -444,9 +613,9 @@ def fp_curve(
 
     return S(
         "fp_curve",
-        globals()["pts"](*pts),
+        _pts(*pts),
         layer,
-        globals()["width"](width),
+        _width(width),
         _opt("locked", locked),
         tstamp(),
     )
@@ -479,7 +648,7 @@ def pad(
         str(number),
         S(type),
         S(shape),
-        globals()["at"](*at),
+        _at(*at),
         _opt("locked", locked),
         S("size", *size),
         drill,
@@ -559,7 +728,7 @@ def gr_text(
     return S(
         "gr_text",
         text,
-        globals()["at"](*at),
+        _at(*at),
         layer,
         effects,
         tstamp(),
@@ -580,7 +749,7 @@ def gr_line(
         S("start", *start),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         tstamp(),
     )
 
@@ -600,8 +769,8 @@ def gr_rect(
         S("start", *start),
         S("end", *end),
         layer,
-        globals()["width"](width),
-        globals()["fill"](fill),
+        _width(width),
+        _fill(fill),
         tstamp(),
     )
 
@@ -621,8 +790,8 @@ def gr_circle(
         S("center", *center),
         S("end", *end),
         layer,
-        globals()["width"](width),
-        globals()["fill"](fill),
+        _width(width),
+        _fill(fill),
         tstamp(),
     )
 
@@ -643,7 +812,7 @@ def gr_arc(
         S("mid", *mid),
         S("end", *end),
         layer,
-        globals()["width"](width),
+        _width(width),
         tstamp(),
     )
 
@@ -659,10 +828,10 @@ def gr_poly(
 
     return S(
         "gr_poly",
-        globals()["pts"](*pts),
+        _pts(*pts),
         layer,
-        globals()["width"](width),
-        globals()["fill"](fill),
+        _width(width),
+        _fill(fill),
         tstamp(),
     )
 
@@ -677,9 +846,9 @@ def gr_curve(
 
     return S(
         "gr_curve",
-        globals()["pts"](*pts),
+        _pts(*pts),
         layer,
-        globals()["width"](width),
+        _width(width),
         tstamp(),
     )
 
@@ -750,7 +919,7 @@ def dimension(
         S("type", S(type)),
         layer,
         tstamp(),
-        pts(S("xy", *start), S("xy", *end)),
+        pts(xy(*start), xy(*end)),
         _opt("height", height),
         _opt("orientation", orientation),
         _opt("leader_length", leader_length),
@@ -2,17 +2,21 @@
 # Published under the standard MIT License.
 # Full text available at: https://opensource.org/licenses/MIT
 
-import re
+import copy
+import functools
 import time
 
 import cssselect2
-from defusedxml import ElementTree
+import numpy as np
+from lxml import etree as ElementTree
 
 from ._cffi_deps import cairocffi, cairosvg
 from ._print import printv
 
 
-# Monkeypatches cssselect2.ElementWrapper to add get and set methods.
+# Monkeypatches cssselect2.ElementWrapper to add get, set, and keys methods so
+# that it can be passed to svgpathtools' svg_to_paths helpers. Gingerbread's
+# own code reads attributes through etree_element directly.
 def _el_get(self, key, default=None):
     return self.etree_element.get(key, default)
 
@@ -21,8 +25,50 @@ def _el_set(self, key, val):
     return self.etree_element.set(key, val)
 
 
+def _el_keys(self):
+    return self.etree_element.keys()
+
+
 setattr(cssselect2.ElementWrapper, "get", _el_get)
 setattr(cssselect2.ElementWrapper, "set", _el_set)
+setattr(cssselect2.ElementWrapper, "keys", _el_keys)
+
+_SVG_G = "{http://www.w3.org/2000/svg}g"
+
+# Hardened the same way defusedxml was: no entity expansion, no network access
+# for external resources. huge_tree lifts libxml2's limits on text node size
+# and tree depth, which large boards with embedded images can run into.
+# Note: remove_blank_text isn't used since whitespace between tspans in
+# <text> elements is significant.
+_XML_PARSER = ElementTree.XMLParser(
+    resolve_entities=False, no_network=True, huge_tree=True
+)
+# Paint values that recolor leaves alone.
+_KEEP_PAINT = ("none", "inherit")
+_BLACK = ("black", "#000", "#000000")
+# Elements that can paint with colors recolor doesn't reach, such as
+# stylesheets and embedded images.
+_UNRECOLORABLE = ("style", "image", "mask", "filter")
+
+
+# Selectors like "#Drills *" are queried once per alias on every conversion,
+# so parse each one only once.
+@functools.lru_cache(maxsize=256)
+def _compile_selector(selector):
+    return tuple(cssselect2.compile_selector_list(selector))
+
+
+def _is_layer_in(node, layers: frozenset) -> bool:
+    node_id = node.attrib.get("id")
+
+    if node_id in layers:
+        return True
+
+    # Check if this is a group with the layer as its single child.
+    if node_id is None and node.tag == _SVG_G and len(node):
+        return node[0].attrib.get("id") in layers
+
+    return False
 
 
 class SVGDocument:
@@ -35,89 +81,230 @@ class SVGDocument:
         else:
             self.svg_bytes = text.encode("utf-8")
 
-        self.etree = ElementTree.XML(self.svg_bytes)
-        self.csstree = cssselect2.ElementWrapper.from_xml_root(self.etree)
+        self.etree = ElementTree.XML(self.svg_bytes, parser=_XML_PARSER)
+
+    @functools.cached_property
+    def csstree(self):
+        return cssselect2.ElementWrapper.from_xml_root(self.etree)
 
     def copy(self):
-        return SVGDocument(text=self.tostring(), dpi=self.dpi)
+        # Copying the element tree is much cheaper than serializing and
+        # re-parsing the document for every layer.
+        new = SVGDocument.__new__(SVGDocument)
+        new.dpi = self.dpi
+        new.svg_bytes = None
+        new.etree = copy.deepcopy(self.etree)
+        return new
+
+    def copy_layers(self, keep):
+        """Same as copy() followed by remove_layers(keep), but without copying
+        the layers that would just be removed."""
+        keep = frozenset(keep)
+        root = self.etree
+
+        new_root = ElementTree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+        new_root.text = root.text
+        new_root.extend(
+            copy.deepcopy(node) for node in root if _is_layer_in(node, keep)
+        )
+
+        new = SVGDocument.__new__(SVGDocument)
+        new.dpi = self.dpi
+        new.svg_bytes = None
+        new.etree = new_root
+        return new
 
     @property
-    def dpmm(self):
-        return 25.4 / self.dpi
+    def dpi(self):
+        return self._dpi
+
+    @dpi.setter
+    def dpi(self, val):
+        # The scale is calculated once here since it's used for every
+        # coordinate converted with to_mm.
+        self._dpi = val
+        self.dpmm = 25.4 / val
 
     def to_mm(self, val, places=2):
-        if not isinstance(val, float):
-            val = float(val)
-        return round(val * self.dpmm, places)
+        return round(float(val) * self.dpmm, places)
 
     def iter_to_mm(self, vals, places=2):
+        dpmm = self.dpmm
         for val in vals:
-            yield self.to_mm(val, places=places)
+            yield round(float(val) * dpmm, places)
+
+    def bbox_to_mm(self, xmin, xmax, ymin, ymax, places=2) -> list[float]:
+        # Same as iter_to_mm(bbox_to_rect(...)), without the generator.
+        dpmm = self.dpmm
+        return [
+            round(float(xmin) * dpmm, places),
+            round(float(ymin) * dpmm, places),
+            round(float(xmax - xmin) * dpmm, places),
+            round(float(ymax - ymin) * dpmm, places),
+        ]
 
     def points_to_mm(self, pts, places=2):
+        dpmm = self.dpmm
         for pt in pts:
-            yield (self.to_mm(pt[0], places=places), self.to_mm(pt[1], places=places))
+            yield (
+                round(float(pt[0]) * dpmm, places),
+                round(float(pt[1]) * dpmm, places),
+            )
+
+    def points_to_mm_array(self, pts: np.ndarray, places=2) -> np.ndarray:
+        # Same as points_to_mm, but works on a whole array of any shape at
+        # once. See _round_array.
+        return _round_array(pts * self.dpmm, places)
 
     def query_all(self, selector):
-        yield from self.csstree.query_all(selector)
+        yield from self.csstree.query_all(*_compile_selector(selector))
+
+    def find_ids(self, ids) -> dict[str, list[cssselect2.ElementWrapper]]:
+        """Finds all elements with any of the given ids in a single pass
+        over the document."""
+        ids = frozenset(ids)
+        found = {}
+
+        for el in self.csstree.iter_subtree():
+            if el.id in ids:
+                found.setdefault(el.id, []).append(el)
+
+        return found
 
     def remove_layers(self, keep=None):
-        keep = keep or []
+        keep = frozenset(keep or ())
         keep_found = False
         count = 0
 
-        for node in list(self.etree):
-            if node.attrib.get("id", "") in keep:
+        for node in self.etree[:]:
+            if _is_layer_in(node, keep):
                 node.attrib["visibility"] = "visible"
                 keep_found = True
                 continue
 
-            # Check if this is a group with the layer as its single child.
-            elif (
-                node.tag == "{http://www.w3.org/2000/svg}g"
-                and node.attrib.get("id", None) is None
-            ):
-                children = list(node)
-                if children and children[0].attrib.get("id", "") in keep:
-                    node.attrib["visibility"] = "visible"
-                    keep_found = True
-                    continue
-
             self.etree.remove(node)
             count += 1
 
-        printv(f"Removed {count} layers, keeping {keep}")
+        printv(f"Removed {count} layers, keeping {sorted(keep)}")
 
         return keep_found
 
     def recolor(self, fill="black", stroke="black"):
+        """Sets every fill and stroke in the document to the given colors,
+        both in style attributes and in fill and stroke attributes."""
+        colors = {"fill": fill, "stroke": stroke}
         count = 0
 
-        for el in self.csstree.query_all("[style]"):
-            style = el.get("style")
-            style = re.sub(r"fill:[^none](.+?);", f"fill:{fill};", style)
-            style = re.sub(r"stroke:[^none](.+?);", f"stroke:{fill};", style)
-            el.set("style", style)
-            count += 1
+        for el in self.etree.iter(ElementTree.Element):
+            attrib = el.attrib
+            recolored = False
+
+            for name, color in colors.items():
+                value = attrib.get(name)
+                if value is not None and value.strip() not in _KEEP_PAINT:
+                    attrib[name] = color
+                    recolored = True
+
+            style = attrib.get("style")
+            if style is not None:
+                attrib["style"] = _recolor_style(style, colors)
+                recolored = True
+
+            count += recolored
 
         printv(f"Recolored {count} elements")
 
+    def is_all_black(self) -> bool:
+        """Returns True if everything in the document is painted black, in
+        which case rendering it with mono=True gives the same coverage as
+        rendering it in color."""
+        for el in self.etree.iter(ElementTree.Element):
+            if ElementTree.QName(el).localname in _UNRECOLORABLE:
+                return False
+
+            paints = [el.get("fill"), el.get("stroke")]
+            for name, value in _iter_style(el.get("style", "")):
+                if name in ("fill", "stroke"):
+                    paints.append(value)
+
+            for value in paints:
+                if value is None or value in _KEEP_PAINT:
+                    continue
+                if value.lower() not in _BLACK:
+                    return False
+
+        return True
+
     def tobytestring(self):
-        return ElementTree.tostring(self.etree)
+        return ElementTree.tostring(self.etree, encoding="utf-8")
 
     def tostring(self):
-        return ElementTree.tostring(self.etree, encoding="unicode")
+        return self.tobytestring().decode("utf-8")
+
+    def render(self, mono: bool = False) -> cairocffi.Surface:
+        return render(self.tobytestring(), dpi=self.dpi, mono=mono)
+
+
+def _round_array(values: np.ndarray, places: int) -> np.ndarray:
+    """Rounds an array exactly the same way round() does."""
+    # np.round scales the values up by 10**places before rounding them, which
+    # can push a value that's just to one side of a tie, like 0.125 really
+    # being 0.12499999..., over to the other side. That can only happen very
+    # close to a tie, so those values are redone with round() itself.
+    scale = 10.0**places
+    scaled = values * scale
+    out = np.round(scaled) / scale
+
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    out[near_tie] = [round(val, places) for val in values[near_tie].tolist()]
+
+    return out
+
+
+def _iter_style(style: str):
+    # Yields the (name, value) pairs of a style attribute's declarations.
+    for decl in style.split(";"):
+        name, sep, value = decl.partition(":")
+        if sep:
+            yield name.strip(), value.strip()
+
+
+def _recolor_style(style: str, colors: dict[str, str]) -> str:
+    decls = []
+
+    for decl in style.split(";"):
+        name, sep, value = decl.partition(":")
+        color = colors.get(name.strip())
+        if sep and color and value.strip() not in _KEEP_PAINT:
+            decl = f"{name}:{color}"
+        decls.append(decl)
+
+    return ";".join(decls)
+
+
+class _MonoPNGSurface(cairosvg.surface.PNGSurface):
+    # Renders into an 8-bit alpha-only surface. This is a quarter of the size
+    # of the usual ARGB32 surface, but it only keeps coverage and drops color,
+    # so it must only be used for documents where everything is painted black.
+    # See SVGDocument.is_all_black.
+    def _create_surface(self, width, height):
+        width = int(round(width))
+        height = int(round(height))
+        cairo_surface = cairocffi.ImageSurface(cairocffi.FORMAT_A8, width, height)
+        return cairo_surface, width, height
+
 
-    def render(self) -> cairocffi.Surface:
-        printv(f"Rendering SVG dpi={self.dpi}")
-        start_time = time.perf_counter()
+def render(svg: str | bytes, dpi: float, mono: bool = False) -> cairocffi.Surface:
+    printv(f"Rendering SVG dpi={dpi} {mono=}")
+    start_time = time.perf_counter()
 
-        tree = cairosvg.parser.Tree(bytestring=self.tostring())
+    tree = cairosvg.parser.Tree(bytestring=svg)
 
-        surface = cairosvg.surface.PNGSurface(tree, output=None, dpi=self.dpi)
-        surface.cairo.flush()
+    surface_class = _MonoPNGSurface if mono else cairosvg.surface.PNGSurface
+    surface = surface_class(tree, output=None, dpi=dpi)
+    surface.cairo.flush()
 
-        delta = time.perf_counter() - start_time
-        printv(f"Rendering took {delta:0.2f} s")
+    delta = time.perf_counter() - start_time
+    printv(f"Rendering took {delta:0.2f} s")
 
-        return surface.cairo
+    return surface.cairo
@@ -3,21 +3,43 @@
 # Full text available at: https://opensource.org/licenses/MIT
 
 
+import functools
+import hashlib
 import inspect
+import os
 import pathlib
+import tempfile
+
+
+@functools.cache
+def _signature(function) -> inspect.Signature:
+    return inspect.signature(function)
 
 
 def default_param_value(function, name):
-    sig = inspect.signature(function)
+    sig = _signature(function)
     params = sig.parameters
     return params[name].default
 
 
-def compare_file_to_string(filename: pathlib.Path, contents: str) -> bool:
-    if not filename.exists():
-        return False
+def sha256_hexdigest(contents: str | bytes) -> str:
+    if isinstance(contents, str):
+        contents = contents.encode("utf-8")
+    return hashlib.sha256(contents).hexdigest()
+
+
+def write_atomic(filename: pathlib.Path, contents: str | bytes):
+    """Writes to a temporary file next to filename and then moves it into
+    place, so that an interrupted write never leaves a partial file behind."""
+    if isinstance(contents, str):
+        contents = contents.encode("utf-8")
 
-    with open(filename, "r") as fh:
-        file_contents = fh.read()
+    fd, tmp_filename = tempfile.mkstemp(dir=filename.parent, prefix=filename.name)
 
-    return contents == file_contents
+    try:
+        with open(fd, "wb") as fh:
+            fh.write(contents)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
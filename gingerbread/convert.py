@@ -3,16 +3,34 @@
 # Full text available at: https://opensource.org/licenses/MIT
 
 import argparse
+import atexit
+import concurrent.futures
 import datetime
+import functools
+import io
+import itertools
+import json
+import math
+import operator
+import os
 import pathlib
+import re
 import sys
 
+import gdstk
+import numpy as np
 import svgpathtools
-import svgpathtools.svg_to_paths
 
 from . import _geometry, _svg_document, pcb, trace
-from ._print import print, printv, set_timing, set_verbose
-from ._utils import compare_file_to_string, default_param_value
+from ._print import (
+    get_timing,
+    get_verbose,
+    print,
+    printv,
+    set_timing,
+    set_verbose,
+)
+from ._utils import default_param_value, sha256_hexdigest, write_atomic
 
 _EDGE_LAYERS = ("Edge.Cuts", "EdgeCuts", "Outline")
 _DRILL_LAYERS = ("Drill", "Drills")
@@ -38,6 +56,12 @@ class Converter:
         self.workdir = pathlib.Path(".", ".cache")
         self.workdir.mkdir(parents=True, exist_ok=True)
 
+    @functools.cached_property
+    def _named_elements(self):
+        # The outline and drill layers are all found with a single walk of
+        # the document.
+        return self.doc.find_ids(_EDGE_LAYERS + _DRILL_LAYERS)
+
     @property
     def centroid(self):
         return self.bbox[0] + (self.bbox[2] / 2), self.bbox[1] + (self.bbox[3] / 2)
@@ -68,8 +92,7 @@ class Converter:
         # Find the edgecuts layer
         edge_cuts_layer = []
         for name in _EDGE_LAYERS:
-            name = name.replace(".", r"\.")
-            edge_cuts_layer.extend(list(self.doc.query_all(f"#{name}")))
+            edge_cuts_layer.extend(self._named_elements.get(name, []))
 
         if len(edge_cuts_layer) == 0:
             raise ConversionError("Edge.Cuts layer not found")
@@ -102,22 +125,24 @@ class Converter:
             )
 
         # Convert all edge cut shapes to paths. The items in the tuple are
-        # area, brect, and the parsed path.
-        paths: list[float, tuple(float, float, float, float), svgpathtools.Path] = []
+        # area, brect, and the points for each of the path's continuous
+        # subpaths.
+        paths: list[float, tuple(float, float, float, float), list[np.ndarray]] = []
 
         for elem, path in _geometry.svg_elements_to_paths(edge_cuts_elems):
             if path is None:
                 print(f"- [red] Not converting unknown element {elem.local_name}")
                 continue
 
-            brect = list(self.doc.iter_to_mm(_geometry.bbox_to_rect(*path.bbox())))
+            subpaths, bbox = _geometry.flatten_path(path)
+            brect = self.doc.bbox_to_mm(*bbox)
 
             # Note: using approximate area based on just the bounding box,
             # since it isn't necessary for our purposes to know the area of the
             # actual curve, just the area of its bbox.
             area = round(abs(brect[2] * brect[3]))
 
-            paths.append((area, brect, path))
+            paths.append((area, brect, subpaths))
 
             printv(
                 f"- Converted [cyan]{elem.local_name}[/cyan] with {len(path)} segments, bounding rect {brect}, and area of {area:.2f} mm²"
@@ -129,9 +154,7 @@ class Converter:
         # Figure out the bounding box (path) of the design so that the offset
         # can be determined. The path with the largest bounding box area is the
         # board bounding box.
-        paths.sort(key=lambda p: p[0], reverse=True)
-
-        bounding_area, bounding_brect, _ = paths[0]
+        bounding_area, bounding_brect, _ = max(paths, key=operator.itemgetter(0))
 
         if bounding_brect[0] != 0 or bounding_brect[1] != 0:
             print(
@@ -177,9 +200,9 @@ class Converter:
         )
 
         # Add all paths as polygons
-        for _, _, path in paths:
-            for subpath in path.continuous_subpaths():
-                points = self.doc.points_to_mm(_geometry.path_to_points(subpath))
+        for _, _, subpaths in paths:
+            for subpath_points in subpaths:
+                points = self.doc.points_to_mm_array(subpath_points)
                 self.pcb.add_poly(points, layer="Edge.Cuts", width=0.5, fill=False)
 
         return True
@@ -189,9 +212,11 @@ class Converter:
 
         drill_elms = []
         for name in _DRILL_LAYERS:
-            drill_elms.extend(list(self.doc.query_all(f"#{name} *")))
+            for layer in self._named_elements.get(name, []):
+                # Skip the layer element itself, only its descendants matter.
+                drill_elms.extend(itertools.islice(layer.iter_subtree(), 1, None))
 
-        count = 0
+        circles = []
         for el in drill_elms:
             if el.local_name != "circle":
                 print(
@@ -199,14 +224,33 @@ class Converter:
                 )
                 continue
 
-            x = self.doc.to_mm(el.get("cx"))
-            y = self.doc.to_mm(el.get("cy"))
-            d = self.doc.to_mm(float(el.get("r")) * 2)
+            attrib = el.etree_element.attrib
+
+            # The center defaults to 0, 0 as it does in SVG, but a circle
+            # without a radius isn't drawn at all.
+            if "r" not in attrib:
+                print(
+                    "- [yellow]Warning:[/yellow] circle without a radius not converted."
+                )
+                continue
 
-            self.pcb.add_drill(x, y, d)
+            circles.append((attrib.get("cx", "0"), attrib.get("cy", "0"), attrib["r"]))
 
-            printv(f"- Drill @ ({x:.2f}, {y:.2f}) mm, ⌀ {d:.2f} mm")
-            count += 1
+        # Parse and scale all of the drill coordinates in one go.
+        drills = np.array(circles, dtype=np.float64).reshape(-1, 3)
+        drills[:, 2] *= 2
+        drills = self.doc.points_to_mm_array(drills)
+
+        drills = drills.tolist()
+        self.pcb.add_drills(drills)
+
+        # Boards can have thousands of drills, so don't bother formatting
+        # these unless they'll actually be shown.
+        if get_verbose():
+            for x, y, d in drills:
+                printv(f"- Drill @ ({x:.2f}, {y:.2f}) mm, ⌀ {d:.2f} mm")
+
+        count = len(drills)
 
         if count:
             print(f"[green]Drills converted[/green]: [cyan]{count}[/cyan]")
@@ -218,20 +262,56 @@ class Converter:
     def convert_layers(
         self, recolor: bool = True, cache: bool = True, save_layer_images: bool = False
     ):
-        # This previously used multiple threads to work around the slowness of
-        # having to shell out to bitmap2component, but when we switched to
-        # gingerbread.trace the threads no longer saved any time.
+        # Each layer is rendered and traced in a worker process, since both
+        # cairosvg and the Python side of gingerbread.trace hold the GIL. Only
+        # the layer's serialized SVG is sent to the workers, the document itself
+        # is prepared here.
         print("[bold]Converting graphic layers")
 
+        # The cache manifest maps each layer to the digest of the SVG its
+        # cached footprint was generated from. It also records the digest of
+        # the whole source document and settings, when those haven't changed
+        # the cached layers can be used without preparing their SVGs at all.
+        manifest_filename = self.workdir / "manifest.json"
+        # The document is serialized rather than hashing the file it came
+        # from, since it may have been changed since it was loaded.
+        document_digest = sha256_hexdigest(self.doc.tobytestring())
+        source_digest = sha256_hexdigest(
+            f"{document_digest}:dpi={self.doc.dpi}:{recolor=}"
+        )
+        position = list(self.pcb.offset)
+        cached_digests = {}
+        source_unchanged = False
+        position_unchanged = False
+
+        if cache and manifest_filename.exists():
+            manifest = json.loads(manifest_filename.read_text())
+            cached_digests = manifest.get("layers", {})
+            source_unchanged = manifest.get("source") == source_digest
+            # Footprints have the board's offset baked in, so they can only be
+            # reused as-is if the outline hasn't moved. The traced polygons are
+            # cached separately and don't depend on it.
+            position_unchanged = manifest.get("position") == position
+
+        pending = {}
+        jobs = []
+
         for canonical, aliases in _GRAPHIC_LAYERS.items():
             svg_filename = self.workdir / f"{canonical}.svg"
             png_filename = self.workdir / f"{canonical}.png"
             footprint_filename = self.workdir / f"{canonical}.kicad_mod"
+            polys_filename = self.workdir / f"{canonical}.npz"
+            footprint_cached = position_unchanged and footprint_filename.exists()
 
             printv(f"Processing {canonical}")
 
+            if source_unchanged and canonical in cached_digests and footprint_cached:
+                print(f"{canonical:<10} [cyan]cached[/cyan]")
+                pending[canonical] = (None, cached_digests[canonical])
+                continue
+
             printv("Preparing SVG for rendering")
-            doc = self.doc.copy()
+            doc = self.doc.copy_layers(keep=aliases)
 
             if not doc.remove_layers(keep=aliases):
                 print(f"{canonical:<10} [yellow]not found[/yellow]")
@@ -241,46 +321,349 @@ class Converter:
             if recolor:
                 doc.recolor()
 
-            svg_text = doc.tostring()
+            # Serialized once here and passed along for both the cache digest
+            # and rendering.
+            svg_bytes = doc.tobytestring()
+            svg_digest = sha256_hexdigest(svg_bytes)
 
             # See if the cached layer hasn't changed, if so, don't bother re-rendering.
             if (
                 cache
-                and footprint_filename.exists()
-                and compare_file_to_string(svg_filename, svg_text)
+                and cached_digests.get(canonical) == svg_digest
+                and (footprint_cached or polys_filename.exists())
             ):
                 print(f"{canonical:<10} [cyan]cached[/cyan]")
 
+                # Only the position changed, so the footprint just needs to be
+                # generated again from the cached polygons.
+                if not footprint_cached:
+                    printv("Regenerating footprint from cached polygons")
+                    write_atomic(
+                        footprint_filename,
+                        trace.generate_footprint(
+                            polys=_load_polys(polys_filename),
+                            dpi=doc.dpi,
+                            layer=canonical,
+                            position=self.pcb.offset,
+                        ),
+                    )
+
+                pending[canonical] = (None, svg_digest)
+
+            # Layers made up of only simple filled shapes can be converted
+            # straight to polygons without rendering and tracing them.
+            elif (
+                recolor
+                and not save_layer_images
+                and (polys := _layer_to_polys(doc)) is not None
+            ):
+                printv("Layer only contains simple shapes, skipping tracing")
+
+                footprint = None
+                if polys:
+                    footprint = trace.generate_footprint(
+                        polys=polys,
+                        dpi=doc.dpi,
+                        layer=canonical,
+                        position=self.pcb.offset,
+                    )
+
+                    if cache:
+                        _save_polys(polys_filename, polys)
+                        write_atomic(footprint_filename, footprint)
+
+                # Wrapped up in a future so that it's collected along with the
+                # traced layers below.
+                future = concurrent.futures.Future()
+                future.set_result(footprint)
+                pending[canonical] = (future, svg_digest)
+
             # No cached version, render and convert it.
             else:
-                if cache:
-                    svg_filename.write_text(svg_text)
+                # The layer's SVG is only needed for the cache check, so it's
+                # only written out for debugging alongside the layer images.
+                if save_layer_images:
+                    svg_filename.write_bytes(svg_bytes)
+
+                job = functools.partial(
+                    _convert_layer,
+                    canonical,
+                    svg_bytes,
+                    dpi=doc.dpi,
+                    position=self.pcb.offset,
+                    footprint_filename=footprint_filename if cache else None,
+                    polys_filename=polys_filename if cache else None,
+                    png_filename=png_filename if save_layer_images else None,
+                    # Rendering to an alpha-only surface loses color, so it's
+                    # only used when nothing depends on it.
+                    mono=doc.is_all_black(),
+                )
+                jobs.append((canonical, svg_digest, job))
+
+        # Starting up the worker processes costs more than it saves when only
+        # a single layer needs to be rendered, such as when everything else is
+        # cached, so that's converted right here instead.
+        for canonical, svg_digest, job in jobs:
+            if len(jobs) == 1:
+                future = concurrent.futures.Future()
+                future.set_result(job())
+            else:
+                future = _layer_executor().submit(
+                    _run_layer_job, get_verbose(), get_timing(), job
+                )
 
-                surface = doc.render()
+            pending[canonical] = (future, svg_digest)
 
-                printv("Preparing image for tracing")
+        # Only the layers that make it onto the board this time are written
+        # back to the manifest, so that layers which have since been removed
+        # or emptied are never picked up from the cache.
+        layer_digests = {}
 
-                image = trace._load_image(surface)
+        # Results are collected in layer order so that the output PCB is the
+        # same regardless of which worker finishes first.
+        for canonical in _GRAPHIC_LAYERS:
+            if canonical not in pending:
+                continue
 
-                if save_layer_images:
-                    printv(f"Saving {png_filename}")
-                    image.write_to_file(png_filename)
+            future, svg_digest = pending[canonical]
+            footprint_filename = self.workdir / f"{canonical}.kicad_mod"
 
-                bitmap = trace._prepare_image(image, invert=False, threshold=127)
-                polys = trace._trace_bitmap_to_polys(bitmap, center=False)
+            # Cached footprints are copied in right away rather than when the
+            # PCB is written, since the cache is shared with any other
+            # conversion in the same directory.
+            if future is None:
+                layer_digests[canonical] = svg_digest
+                self.pcb.add_literal_file(footprint_filename)
+                continue
 
-                if not polys:
-                    print(f"{canonical:<10} [red]empty[red]")
-                    continue
+            footprint = future.result()
 
-                footprint = trace.generate_footprint(
-                    polys=polys, dpi=doc.dpi, layer=canonical, position=self.pcb.offset
-                )
-                footprint_filename.write_text(footprint)
+            if footprint is None:
+                print(f"{canonical:<10} [red]empty[red]")
+                continue
+
+            layer_digests[canonical] = svg_digest
+
+            print(f"{canonical:<10} [green]converted[green]")
+
+            self.pcb.add_literal(footprint)
+
+        if cache:
+            manifest = dict(
+                source=source_digest, position=position, layers=layer_digests
+            )
+            write_atomic(manifest_filename, json.dumps(manifest, indent=2))
+
+
+# Layers that contain only these elements, with no transforms, strokes,
+# or other effects, are converted directly. See _layer_to_polys.
+_DIRECT_ELEMENTS = ("g", "rect", "polygon", "path")
+_DIRECT_UNSUPPORTED_PROPERTIES = (
+    "transform",
+    "clip-path",
+    "mask",
+    "filter",
+    "marker-start",
+    "marker-mid",
+    "marker-end",
+)
+# The number of each unit in an inch, for the units cairosvg resolves using
+# the document's dpi.
+_UNITS_PER_INCH = {"in": 1, "cm": 2.54, "mm": 25.4, "pt": 72, "pc": 6}
+_LENGTH_RE = re.compile(r"\s*([^a-z%\s]+)\s*([a-z%]*)\s*")
+
+
+def _layer_to_polys(doc: _svg_document.SVGDocument) -> list[gdstk.Polygon] | None:
+    """Converts a layer made up of only simple filled shapes directly into
+    polygons.
+
+    Returns None if the layer has anything that needs to be rendered and traced
+    instead, such as curves, strokes, transforms, non-black fills, lengths with
+    units, or a viewBox that scales the document.
+    """
+    try:
+        if not doc.is_all_black() or not _has_pixel_scale(doc):
+            return None
+    except ValueError:
+        return None
+
+    elems = []
 
-                print(f"{canonical:<10} [green]converted[green]")
+    for elem in doc.csstree.iter_subtree():
+        is_root = elem.etree_element is doc.etree
 
-            self.pcb.add_literal(footprint_filename.read_text())
+        if not is_root and elem.local_name not in _DIRECT_ELEMENTS:
+            return None
+
+        props = dict(elem.etree_element.attrib)
+        for decl in elem.etree_element.get("style", "").split(";"):
+            name, _, value = decl.partition(":")
+            props[name.strip()] = value.strip()
+
+        if any(name in props for name in _DIRECT_UNSUPPORTED_PROPERTIES):
+            return None
+        if props.get("stroke", "none") != "none" or props.get("fill") == "none":
+            return None
+        if props.get("fill-rule", "nonzero") != "nonzero":
+            return None
+        if props.get("opacity", "1") != "1" or props.get("fill-opacity", "1") != "1":
+            return None
+        if props.get("display") == "none" or props.get("visibility") == "hidden":
+            return None
+
+        if not is_root and elem.local_name != "g":
+            elems.append(elem)
+
+    polys = []
+
+    try:
+        paths = [path for _, path in _geometry.svg_elements_to_paths(elems)]
+    except ValueError:
+        # Coordinates with units or percentages, which only the renderer
+        # knows how to resolve.
+        return None
+
+    for path in paths:
+        if not path.iscontinuous() or not all(
+            isinstance(seg, svgpathtools.Line) for seg in path
+        ):
+            return None
+
+        pts = [(seg.start.real, seg.start.imag) for seg in path]
+        if len(pts) >= 3:
+            polys.append(gdstk.Polygon(pts))
+
+    return polys
+
+
+def _has_pixel_scale(doc: _svg_document.SVGDocument) -> bool:
+    # Whether the document's user units come out as exactly one pixel each
+    # when it's rendered, so that shapes can be converted without rendering
+    # them and still line up with traced layers.
+    root = doc.etree
+    view_box = root.get("viewBox")
+
+    if view_box is None:
+        return True
+
+    x, y, width, height = (float(val) for val in view_box.replace(",", " ").split())
+
+    if x != 0 or y != 0:
+        return False
+
+    for length, size in ((root.get("width"), width), (root.get("height"), height)):
+        if length is not None and not math.isclose(
+            _length_to_px(length, doc.dpi), size
+        ):
+            return False
+
+    return True
+
+
+def _length_to_px(length: str, dpi: float) -> float:
+    # Resolves a length the same way cairosvg does for the root element's
+    # width and height. Anything relative, like percentages, raises a
+    # ValueError.
+    match = _LENGTH_RE.fullmatch(length)
+    if match is None:
+        raise ValueError(f"Can't resolve length {length!r}")
+
+    value, unit = float(match[1]), match[2]
+
+    if unit in ("", "px"):
+        return value
+    if unit in _UNITS_PER_INCH:
+        return value * dpi / _UNITS_PER_INCH[unit]
+
+    raise ValueError(f"Can't resolve length {length!r}")
+
+
+_executor = None
+
+
+def _layer_executor() -> concurrent.futures.ProcessPoolExecutor:
+    # The pool is created once and kept around so that converting multiple
+    # documents in the same process doesn't pay the worker startup cost again.
+    # It's shut down when the interpreter exits.
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(len(_GRAPHIC_LAYERS), os.cpu_count() or 1),
+        )
+        atexit.register(_executor.shutdown)
+
+    return _executor
+
+
+def _run_layer_job(verbose: bool, timing: bool, job):
+    # The output settings are sent along with each job rather than once when
+    # the pool starts, since they can change between conversions.
+    set_verbose(verbose)
+    set_timing(timing)
+    return job()
+
+
+def _convert_layer(
+    canonical: str,
+    svg_bytes: bytes,
+    *,
+    dpi: float,
+    position: tuple[float, float],
+    footprint_filename: pathlib.Path | None = None,
+    polys_filename: pathlib.Path | None = None,
+    png_filename: pathlib.Path | None = None,
+    mono: bool = False,
+) -> str | None:
+    """Renders and traces a single layer's SVG into a footprint.
+
+    Returns the footprint, or None if the layer is empty. The footprint and
+    the traced polygons are also written to footprint_filename and
+    polys_filename, if given, for caching.
+    """
+    surface = _svg_document.render(svg_bytes, dpi=dpi, mono=mono)
+
+    printv("Preparing image for tracing")
+
+    # Alpha-only surfaces can be thresholded directly, unless the image is
+    # wanted on disk in which case it has to go through vips anyway.
+    if mono and not png_filename:
+        bitmap = trace._prepare_surface(surface, invert=False, threshold=127)
+
+    else:
+        image = trace._load_image(surface)
+
+        if png_filename:
+            printv(f"Saving {png_filename}")
+            image.write_to_file(png_filename)
+
+        bitmap = trace._prepare_image(image, invert=False, threshold=127)
+
+    polys = trace._trace_bitmap_to_polys(bitmap, center=False)
+
+    if not polys:
+        return None
+
+    footprint = trace.generate_footprint(
+        polys=polys, dpi=dpi, layer=canonical, position=position
+    )
+    if polys_filename:
+        _save_polys(polys_filename, polys)
+    if footprint_filename:
+        write_atomic(footprint_filename, footprint)
+
+    return footprint
+
+
+def _save_polys(filename: pathlib.Path, polys: list[gdstk.Polygon]):
+    buf = io.BytesIO()
+    np.savez(buf, *(poly.points for poly in polys))
+    write_atomic(filename, buf.getvalue())
+
+
+def _load_polys(filename: pathlib.Path) -> list[gdstk.Polygon]:
+    with np.load(filename) as data:
+        return [gdstk.Polygon(data[f"arr_{n}"]) for n in range(len(data.files))]
 
 
 def convert(
@@ -327,7 +710,8 @@ def convert(
     return pcb_
 
 
-def main():
+@functools.cache
+def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         "convert", formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -380,7 +764,11 @@ def main():
         default=default_param_value(convert, "drills"),
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    args = _build_parser().parse_args()
 
     if args.dest is None:
         args.dest = args.source.with_suffix(".kicad_pcb")
@@ -412,8 +800,7 @@ def main():
         sys.exit(1)
 
     print("[bold]Writing...")
-    with open(args.dest, "w") as fh:
-        pcb_.write(fh)
+    pcb_.write(args.dest)
 
     print(f"[bold][green]Written to {args.dest} :purple_heart:")
 
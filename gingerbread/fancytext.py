@@ -15,21 +15,29 @@
 # - https://gist.github.com/ynkdir/849071
 
 import argparse
+import concurrent.futures
+import functools
 import html
 import math
 import os
 import pathlib
 import sys
-from cmath import sqrt
+import threading
 
 import rich
 import tinycss2.color3
 
 from . import trace
 from ._cffi_deps import cairocffi, pangocairocffi, pangocffi
-from ._print import printv, set_verbose
+from ._print import get_verbose, printv, set_verbose
 from ._utils import default_param_value
 
+_thread_local = threading.local()
+
+# Labels are almost always drawn with the same few colors, and the parsed
+# colors are immutable tuples.
+_parse_color = functools.lru_cache(maxsize=64)(tinycss2.color3.parse_color)
+
 
 def _configure_font_map():
     fontmap = pangocairocffi.ffi.cast(
@@ -38,9 +46,28 @@ def _configure_font_map():
     )
     pangocairocffi.pangocairo.pango_cairo_font_map_set_default(fontmap)
 
+    # The shared context was created with the previous default font map.
+    _thread_local.__dict__.pop("pango_context", None)
+    _thread_local.__dict__.pop("underline_thickness", None)
+
+
+def _pango_context() -> pangocffi.Context:
+    # pangocairocffi.create_layout creates a new Pango context for every
+    # layout, which is relatively expensive. All of the layouts are measured
+    # against the same kind of surface, so one context is shared per thread.
+    if not hasattr(_thread_local, "pango_context"):
+        surface = cairocffi.RecordingSurface(cairocffi.CONTENT_COLOR_ALPHA, None)
+        cairo = cairocffi.Context(surface)
+        _thread_local.pango_surface = surface
+        _thread_local.pango_context = pangocairocffi.create_context(cairo)
+    return _thread_local.pango_context
+
 
 def get_context_size(context: cairocffi.Context) -> tuple[int, int]:
     target = context.get_target()
+    if isinstance(target, cairocffi.RecordingSurface):
+        _, _, width, height = target.get_extents()
+        return (width, height)
     return (target.get_width(), target.get_height())
 
 
@@ -73,8 +100,8 @@ class Text:
         self.line_spacing = line_spacing
         self.font = font
         self.align = align
-        self.fill = tinycss2.color3.parse_color(fill)
-        self.stroke = tinycss2.color3.parse_color(stroke)
+        self.fill = _parse_color(fill)
+        self.stroke = _parse_color(stroke)
         self.stroke_width_mm = stroke_width_mm
         self.dpmm = dpmm
 
@@ -97,9 +124,8 @@ class Text:
         )
 
     def _init_layout(self):
-        self._surface = cairocffi.RecordingSurface(cairocffi.CONTENT_COLOR_ALPHA, None)
-        self._cairo = cairocffi.Context(self._surface)
-        self._layout = pangocairocffi.create_layout(self._cairo)
+        self._layout = pangocffi.Layout(_pango_context())
+        self._path = None
 
         self._layout.set_alignment(getattr(pangocffi.Alignment, self.align.upper()))
         self._layout.set_width(-1)
@@ -141,17 +167,34 @@ class Text:
 
         # Get the underline thickness info from the font. This is a little involved because
         # pangocffi doesn't wrap the methods we need.
-        desc = pangocffi.FontDescription()
-        desc.set_family(self.font)
-        desc.set_weight(pangocffi.Weight.BOLD if self.bold else pangocffi.Weight.NORMAL)
-        desc.set_size(pangocffi.units_from_double(self.size_mm * self.dpmm))
-        metrics = pangocffi.pango.pango_context_get_metrics(
-            self._layout.get_context()._pointer, desc._pointer, pangocffi.ffi.NULL
-        )
-        underline_thickness_px = pangocffi.units_to_double(
-            pangocffi.pango.pango_font_metrics_get_underline_thickness(metrics)
+        # Looking up font metrics is slow, so they're remembered for each
+        # Pango context, font, and size. Layouts share a context per thread,
+        # see _pango_context.
+        context_pointer = self._layout.get_context()._pointer
+        key = (
+            int(pangocffi.ffi.cast("uintptr_t", context_pointer)),
+            self.font,
+            self.size_mm * self.dpmm,
+            self.bold,
         )
-        pangocffi.pango.pango_font_metrics_unref(metrics)
+        cache = _thread_local.__dict__.setdefault("underline_thickness", {})
+
+        if key not in cache:
+            desc = pangocffi.FontDescription()
+            desc.set_family(self.font)
+            desc.set_weight(
+                pangocffi.Weight.BOLD if self.bold else pangocffi.Weight.NORMAL
+            )
+            desc.set_size(pangocffi.units_from_double(self.size_mm * self.dpmm))
+            metrics = pangocffi.pango.pango_context_get_metrics(
+                context_pointer, desc._pointer, pangocffi.ffi.NULL
+            )
+            cache[key] = pangocffi.units_to_double(
+                pangocffi.pango.pango_font_metrics_get_underline_thickness(metrics)
+            )
+            pangocffi.pango.pango_font_metrics_unref(metrics)
+
+        underline_thickness_px = cache[key]
 
         # Now that we know the underline thickness, we cna use that to draw the overbar.
         context.save()
@@ -172,7 +215,13 @@ class Text:
 
         context.translate(lx, ly)
 
-        pangocairocffi.layout_path(context, self._layout)
+        # Labels are drawn more than once (see generate), so the text's path
+        # is kept around instead of having Pango lay it out each time.
+        if self._path is None:
+            pangocairocffi.layout_path(context, self._layout)
+            self._path = context.copy_path()
+        else:
+            context.append_path(self._path)
 
         context.set_source_rgba(*self.fill)
         context.fill_preserve()
@@ -223,6 +272,12 @@ class Text:
         context.restore()
 
 
+_SQRT_2 = math.sqrt(2)
+_RAD_90 = math.radians(90)
+_RAD_270 = math.radians(270)
+_RAD_NEG_90 = math.radians(-90)
+
+
 class Outline:
     def __init__(
         self,
@@ -235,8 +290,8 @@ class Outline:
     ):
         self.left = left
         self.right = right
-        self.fill = tinycss2.color3.parse_color(fill)
-        self.stroke = tinycss2.color3.parse_color(stroke)
+        self.fill = _parse_color(fill)
+        self.stroke = _parse_color(stroke)
         self.stroke_width_mm = stroke_width_mm
         self.padding_mm = padding_mm
 
@@ -258,7 +313,7 @@ class Outline:
         y = t_y - pad_y / 2
         w = t_w + pad_x
         h = t_h + pad_y
-        hyp = h / sqrt(2).real / 2
+        hyp = h / _SQRT_2 / 2
         hyp_2 = hyp / 2
         stroke_width_px = self.stroke_width_mm * text.dpmm
 
@@ -299,7 +354,7 @@ class Outline:
                 context.line_to(0, 0)
             case "(":
                 context.move_to(hyp_2, h)
-                context.arc(hyp_2, h / 2, h / 2, math.radians(90), math.radians(270))
+                context.arc(hyp_2, h / 2, h / 2, _RAD_90, _RAD_270)
                 context.line_to(w / 2, 0)
                 context.line_to(w / 2, h)
                 context.line_to(hyp_2, h)
@@ -338,9 +393,7 @@ class Outline:
                 context.line_to(w / 2, 0)
             case ")":
                 context.move_to(w / 2, 0)
-                context.arc(
-                    w - hyp_2, h / 2, h / 2, math.radians(-90), math.radians(90)
-                )
+                context.arc(w - hyp_2, h / 2, h / 2, _RAD_NEG_90, _RAD_90)
                 context.line_to(w / 2, h)
                 context.line_to(w / 2, 0)
 
@@ -405,6 +458,32 @@ def generate(
 
     w_px = round(text_.logical_extents_px[2] + (padding_mm[0] + 30) * dpmm)
     h_px = round(text_.logical_extents_px[3] + (padding_mm[1] + 10) * dpmm)
+
+    def draw(context: cairocffi.Context, w_px: float):
+        if flip:
+            context.scale(-1, 1)
+            context.translate(-w_px, 0)
+
+        if outline_fill or outline_stroke_mm:
+            outline_.draw(context, text_)
+
+        text_.draw(context)
+
+    # The margins above leave room for any outline, but most of that ends up
+    # empty and would still have to be rasterized and traced. So everything is
+    # drawn once without rasterizing to find out what's actually covered, and
+    # the image is trimmed by the same amount on opposite sides. That keeps
+    # its center, which everything is drawn around and which the footprint is
+    # centered on, in the same place.
+    recording = cairocffi.RecordingSurface(
+        cairocffi.CONTENT_COLOR_ALPHA, (0, 0, w_px, h_px)
+    )
+    draw(cairocffi.Context(recording), w_px)
+    ink_x, ink_y, ink_w, ink_h = recording.ink_extents()
+    trim_x = max(0, math.floor(min(ink_x, w_px - ink_x - ink_w)) - 1)
+    trim_y = max(0, math.floor(min(ink_y, h_px - ink_y - ink_h)) - 1)
+    w_px -= trim_x * 2
+    h_px -= trim_y * 2
     printv(f"Surface size {w_px=} {h_px=}")
 
     surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, w_px, h_px)
@@ -416,13 +495,8 @@ def generate(
 
     if flip:
         printv("Outputting on back layer, flipping image")
-        context.scale(-1, 1)
-        context.translate(-w_px, 0)
 
-    if outline_fill or outline_stroke_mm:
-        outline_.draw(context, text_)
-
-    text_.draw(context)
+    draw(context, w_px)
 
     printv("Tracing image")
     fp = trace.trace(
@@ -443,6 +517,38 @@ def generate(
     return fp
 
 
+def generate_batch(items: list[dict], max_workers: int | None = None) -> list[str]:
+    """Generates a footprint for each item, which are dicts of keyword
+    arguments for generate().
+
+    Each label is independent and most of the work holds the GIL, so the labels
+    are spread across worker processes.
+    """
+    items = list(items)
+
+    # Starting up workers isn't worth it for a single label.
+    if len(items) <= 1:
+        return [generate(**kwargs) for kwargs in items]
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_batch_worker,
+        initargs=(get_verbose(),),
+    ) as executor:
+        return list(executor.map(_generate_kwargs, items))
+
+
+def _init_batch_worker(verbose: bool):
+    set_verbose(verbose)
+
+    if os.environ.get("GINGERBREAD_USE_FONTCONFIG"):
+        _configure_font_map()
+
+
+def _generate_kwargs(kwargs: dict) -> str:
+    return generate(**kwargs)
+
+
 def main():
     import pyperclip
 
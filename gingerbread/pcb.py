@@ -6,7 +6,11 @@
 
 import datetime
 import io
+import shutil
 from os import PathLike
+from typing import Iterable
+
+import numpy as np
 
 from . import _sexpr as s
 
@@ -44,7 +48,7 @@ class PCB:
         self.items = []
 
     def add_line(self, x1, y1, x2, y2, *, layer: str = "F.SilkS", width: float = 0.1):
-        self.items.append(
+        self._add(
             s.gr_line(
                 start=(x1 + self.offset[0], y1 + self.offset[1]),
                 end=(x2 + self.offset[0], y2 + self.offset[1]),
@@ -55,14 +59,17 @@ class PCB:
 
     def add_poly(
         self,
-        points: list[tuple[float, float]],
+        points: list[tuple[float, float]] | np.ndarray,
         *,
         layer: str = "F.SilkS",
         fill: bool = False,
         width: float = 0.1,
     ):
-        pts = ((x + self.offset[0], y + self.offset[1]) for (x, y) in points)
-        self.items.append(
+        if isinstance(points, np.ndarray):
+            pts = (points + self.offset).tolist()
+        else:
+            pts = ((x + self.offset[0], y + self.offset[1]) for (x, y) in points)
+        self._add(
             s.gr_poly(
                 pts=pts,
                 layer=layer,
@@ -82,7 +89,7 @@ class PCB:
         width: float = 0.1,
         fill: bool = True,
     ):
-        self.items.append(
+        self._add(
             s.gr_rect(
                 start=(x + self.offset[0], y + self.offset[1]),
                 end=(x + w + self.offset[0], y + h + self.offset[1]),
@@ -92,26 +99,32 @@ class PCB:
             )
         )
 
-    def add_drill(self, x, y, d):
-        self.items.append(
-            s.footprint(
-                "DrillHole",
-                s.pad(
-                    "",
-                    type="np_thru_hole",
-                    shape="circle",
-                    size=(d, d),
-                    drill=s.drill(d),
-                    layers="*.Cu *.Mask",
-                    clearance=0.1,
-                    zone_connect=0,
-                ),
-                at=(self.offset[0] + x, self.offset[1] + y),
-            )
+    def _drill(self, x, y, d):
+        return s.footprint(
+            "DrillHole",
+            s.pad(
+                "",
+                type="np_thru_hole",
+                shape="circle",
+                size=(d, d),
+                drill=s.drill(d),
+                layers="*.Cu *.Mask",
+                clearance=0.1,
+                zone_connect=0,
+            ),
+            at=(self.offset[0] + x, self.offset[1] + y),
         )
 
+    def add_drill(self, x, y, d):
+        self._add(self._drill(x, y, d))
+
+    def add_drills(self, drills: Iterable[tuple[float, float, float]]):
+        """Adds many drills at once, each given as (x, y, diameter)."""
+        for x, y, d in drills:
+            self._add(self._drill(x, y, d))
+
     def add_slotted_hole(self, x: float, y: float, hole_size: float, slot_size: float):
-        self.items.append(
+        self._add(
             s.footprint(
                 "DrillSlottedHole",
                 s.pad(
@@ -146,7 +159,7 @@ class PCB:
         height = 3 if below else -3
         value = round(x2 - x1, 2)
 
-        self.items.append(
+        self._add(
             s.dimension(
                 start=(x1, y1),
                 end=(x2, y2),
@@ -192,7 +205,7 @@ class PCB:
         value = round(y2 - y1, 2)
         height = -3 if right else 3
 
-        self.items.append(
+        self._add(
             s.dimension(
                 start=(x1, y1),
                 end=(x2, y2),
@@ -220,10 +233,28 @@ class PCB:
             )
         )
 
+    def _add(self, item: s.S):
+        # Items are written out as soon as they're added, since their text
+        # takes up far less memory than their trees of Symbols.
+        item.write(self.text, depth=1)
+
+    def _flush_text(self):
+        if self.text.tell():
+            self.items.append(s.L(self.text.getvalue()))
+            self.text = io.StringIO()
+
     def add_literal(self, val: str):
-        self.items.append(s.L(val))
+        self.text.write(val)
+
+    def add_literal_file(self, filename: str | PathLike):
+        # Copied in right away, rather than when the PCB is written, so that
+        # later changes to the file don't affect this PCB.
+        with open(filename, "r", encoding="utf-8") as fh:
+            shutil.copyfileobj(fh, self.text)
 
     def write(self, filename_or_io):
+        self._flush_text()
+
         pcb = s.kicad_pcb(
             s.general(thickness=1.6),
             s.paper(size="USLetter"),
@@ -259,8 +290,11 @@ class PCB:
             *self.items,
         )
 
+        # The board's items are already text by now, so writing through a
+        # text file only encodes a few large strings. KiCAD files are always
+        # UTF-8, regardless of the locale.
         if isinstance(filename_or_io, (str, PathLike)):
-            with open(filename_or_io, "w") as fh:
+            with open(filename_or_io, "w", encoding="utf-8") as fh:
                 pcb.write(fh)
 
         else:
@@ -13,7 +13,7 @@
 import argparse
 import pathlib
 import sys
-from typing import Generator, Union
+from typing import Union
 
 import gdstk
 import numpy as np
@@ -23,26 +23,68 @@ import rich
 
 from . import _sexpr as s
 from ._cffi_deps import cairocffi
-from ._geometry import bezier_to_points
+from ._geometry import sample_beziers
 from ._print import printv, set_verbose
 
 
-def _path_to_poly_pts(
-    path, bezier_resolution=0.25
-) -> Generator[tuple[float, float], None, None]:
-    last = potracecffi.curve_start_point(path.curve)
-    yield last
+def _curve_arrays(curve) -> tuple[np.ndarray, np.ndarray]:
+    """Returns a potrace curve's segment tags and its (n, 3) array of
+    segment points as complex numbers.
 
-    for segment in potracecffi.iter_curve(path.curve):
-        if segment.tag == potracecffi.CORNER:
-            yield segment.c1
-            yield segment.c2
-        elif segment.tag == potracecffi.CURVETO:
-            yield from bezier_to_points(
-                last, segment.c0, segment.c1, segment.c2, delta=bezier_resolution
-            )
+    These read the curve's memory directly instead of going through
+    potracecffi.iter_curve, which would build an object for every segment.
+    They're only valid for as long as the trace result is alive.
+    """
+    ffi = potracecffi.ffi
+    tags = np.frombuffer(
+        ffi.buffer(curve.tag, curve.n * ffi.sizeof("int")), dtype=np.intc
+    )
+    # potrace_dpoint_t is an (x, y) pair of doubles, which has the same layout
+    # as a complex number.
+    points = np.frombuffer(
+        ffi.buffer(curve.c, curve.n * 3 * ffi.sizeof("potrace_dpoint_t")),
+        dtype=np.complex128,
+    ).reshape(-1, 3)
+    return tags, points
+
+
+def _path_to_poly_pts(path, bezier_resolution=0.25) -> np.ndarray:
+    tags, c = _curve_arrays(path.curve)
+
+    # Each segment starts where the previous one ends, and the path as a
+    # whole starts at the end of the last segment.
+    starts = np.roll(c[:, 2], 1)
+    corners = tags == potracecffi.CORNER
+    curves = tags == potracecffi.CURVETO
+
+    samples, counts = sample_beziers(
+        starts[curves], c[curves, 0], c[curves, 1], c[curves, 2], bezier_resolution
+    )
+
+    # Corners are made up of their two points, curves of their samples and
+    # their end point.
+    sizes = np.zeros(len(tags), dtype=np.intp)
+    sizes[corners] = 2
+    sizes[curves] = counts + 1
+    offsets = np.cumsum(sizes) - sizes + 1
+
+    out = np.empty(sizes.sum() + 1, dtype=np.complex128)
+    out[0] = starts[0]
+
+    corner_offsets = offsets[corners]
+    out[corner_offsets] = c[corners, 1]
+    out[corner_offsets + 1] = c[corners, 2]
+
+    # The samples for all of the curves come back one after another, so each
+    # curve's run of samples is shifted to that curve's offset.
+    curve_offsets = offsets[curves]
+    shift = np.repeat(curve_offsets - (np.cumsum(counts) - counts), counts)
+    out[shift + np.arange(len(samples))] = samples
+    out[curve_offsets + counts] = c[curves, 2]
 
-        last = segment.c2
+    # Complex values are stored as (real, imag) pairs, so this is a view
+    # rather than a copy.
+    return out.view(np.float64).reshape(-1, 2)
 
 
 def _load_image(path_surface_or_image) -> pyvips.Image:
@@ -58,6 +100,13 @@ def _load_image(path_surface_or_image) -> pyvips.Image:
         # This isn't too much of a concern, as the image gets thresholded down to
         # to black and white so the pixel order doesn't really matter.
         path_surface_or_image.flush()
+
+        if path_surface_or_image.get_format() == cairocffi.FORMAT_A8:
+            # The coverage is inverted to match what flattening black onto
+            # white gives.
+            surface_data = 255 - _a8_surface_to_array(path_surface_or_image)
+            return pyvips.Image.new_from_array(surface_data, interpretation="b-w")
+
         surface_data = np.ndarray(
             shape=(
                 path_surface_or_image.get_height(),
@@ -75,6 +124,45 @@ def _load_image(path_surface_or_image) -> pyvips.Image:
         )
 
 
+def _a8_surface_to_array(surface: cairocffi.ImageSurface) -> np.array:
+    # Alpha-only surfaces (see _svg_document.render) have their rows padded
+    # out to the stride, so trim that off.
+    surface.flush()
+    surface_data = np.ndarray(
+        shape=(surface.get_height(), surface.get_stride()),
+        dtype=np.uint8,
+        buffer=surface.get_data(),
+    )
+    return surface_data[:, : surface.get_width()]
+
+
+def _prepare_surface(
+    surface: cairocffi.ImageSurface, invert: bool = False, threshold: int = 127
+) -> np.array:
+    """Thresholds an alpha-only cairo surface straight into a bitmap.
+
+    This gives the same result as _load_image followed by _prepare_image, as
+    a boolean array, but skips copying the whole image into vips and back out
+    again.
+    """
+    printv(f"Image size: {surface.get_width()} x {surface.get_height()}, alpha only")
+    printv(f"Applying {threshold=}")
+
+    coverage = _a8_surface_to_array(surface)
+
+    # The pixel value vips would see is (255 - coverage), so the threshold is
+    # flipped around here.
+    if invert:
+        bitmap = coverage < 255 - threshold
+    else:
+        bitmap = coverage > 255 - threshold
+
+    # potracecffi packs the bitmap down to one bit per pixel itself and only
+    # checks for non-zero bytes, so the boolean array can be handed over as
+    # is without scaling it up to 0/255.
+    return bitmap
+
+
 def _prepare_image(
     image: pyvips.Image, invert: bool = False, threshold: int = 127
 ) -> np.array:
@@ -106,13 +194,10 @@ def _trace_result_to_polys(
     polys_and_holes = []
 
     for path in potracecffi.iter_paths(trace_result):
-        pts = [
-            (p[0] + offset[0], p[1] + offset[1])
-            for p in _path_to_poly_pts(path, bezier_resolution=bezier_resolution)
-        ]
+        pts = _path_to_poly_pts(path, bezier_resolution=bezier_resolution) + offset
 
         hole = path.sign == ord("-")
-        poly = gdstk.Polygon(list(pts))
+        poly = gdstk.Polygon(pts)
 
         if not hole:
             polys_and_holes.append([poly])
@@ -158,7 +243,10 @@ def _trace_bitmap_to_polys(
 
 
 def _generate_fp_poly(poly: gdstk.Polygon, *, layer: str, dpmm: float) -> s.S:
-    pts = ((pt[0] * dpmm, pt[1] * dpmm) for pt in poly.points)
+    # Scaling all of the points at once is much quicker than one at a time,
+    # and traced polygons can have enough points that they're formatted all
+    # at once as well.
+    pts = [s.Points((poly.points * dpmm).ravel().tolist())]
 
     return s.fp_poly(pts=pts, layer=layer, width=0, fill=True)
 
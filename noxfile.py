@@ -21,5 +21,5 @@ def format(s):
 @nox.session
 def test(s):
     s.install(".")
-    s.install("pytest")
-    s.run("pytest", "tests")
+    s.install("pytest", "pytest-xdist")
+    s.run("pytest", "-n", "auto", "tests")
@@ -0,0 +1,163 @@
+# Copyright (c) 2022 Alethea Katherine Flowers.
+# Published under the standard MIT License.
+# Full text available at: https://opensource.org/licenses/MIT
+
+import io
+
+import gdstk
+import pytest
+
+from gingerbread import _svg_document, convert, pcb
+
+from .utils import _remove_timestamps
+
+SVG_NS = 'xmlns="http://www.w3.org/2000/svg"'
+RECT = '<rect width="10" height="10"/>'
+
+
+def test_white_attribute_knockout(tmp_path):
+    # A black square with a white square knocked out of it. The white is set
+    # through a fill attribute and the document isn't recolored, so the
+    # knockout has to stay a hole in the traced layer.
+    doc = _svg_document.SVGDocument(
+        text=f"""<svg {SVG_NS} width="100" height="100">
+            <rect width="100" height="100" fill="black"/>
+            <rect x="25" y="25" width="50" height="50" fill="white"/>
+        </svg>""",
+        dpi=254,
+    )
+    polys_filename = tmp_path / "polys.npz"
+
+    convert._convert_layer(
+        "F.SilkS",
+        doc.tobytestring(),
+        dpi=doc.dpi,
+        position=(0, 0),
+        polys_filename=polys_filename,
+        mono=doc.is_all_black(),
+    )
+
+    polys = convert._load_polys(polys_filename)
+    assert gdstk.inside([(10, 10), (50, 50)], polys) == (True, False)
+
+
+@pytest.mark.parametrize(
+    ["root", "body", "expected"],
+    [
+        ("", '<rect width="10" height="10"/>', 1),
+        ("", '<rect width="10" height="10" fill="white"/>', None),
+        ("", '<rect width="10mm" height="10"/>', None),
+        ("", '<rect x="50%" width="10" height="10"/>', None),
+        ("", '<rect width="10" height="10" fill-rule="evenodd"/>', None),
+        ('width="10mm" height="10mm" viewBox="0 0 100 100"', RECT, 1),
+        ('width="20mm" height="20mm" viewBox="0 0 100 100"', RECT, None),
+        ('width="100%" height="100%" viewBox="0 0 100 100"', RECT, None),
+    ],
+)
+def test_layer_to_polys(root, body, expected):
+    # Anything the shapes can't be converted exactly for has to be left to
+    # rendering and tracing instead.
+    doc = _svg_document.SVGDocument(text=f"<svg {SVG_NS} {root}>{body}</svg>", dpi=254)
+    polys = convert._layer_to_polys(doc)
+
+    if expected is None:
+        assert polys is None
+    else:
+        assert len(polys) == expected
+
+
+def test_removed_layer_is_not_used_from_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with_layer = f'<svg {SVG_NS}><g id="F.SilkS">{RECT}</g></svg>'
+    without_layer = f'<svg {SVG_NS}><g id="F.Cu"/></svg>'
+
+    # The second and third runs are the same document, so the third one sees
+    # an unchanged source and would use any layers left in the manifest.
+    counts = []
+    for text in (with_layer, without_layer, without_layer):
+        converter = convert.Converter(
+            _svg_document.SVGDocument(text=text), pcb.PCB(title="test")
+        )
+        converter.convert_layers()
+        out = io.StringIO()
+        converter.pcb.write(out)
+        counts.append(out.getvalue().count("(footprint "))
+
+    assert counts == [1, 0, 0]
+
+
+def test_cached_layer_is_read_when_converted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def convert_layers(text):
+        converter = convert.Converter(
+            _svg_document.SVGDocument(text=text), pcb.PCB(title="test")
+        )
+        converter.convert_layers()
+        return converter.pcb
+
+    def write(pcb_):
+        out = io.StringIO()
+        pcb_.write(out)
+        return _remove_timestamps(out.getvalue())
+
+    board_a = (
+        f'<svg {SVG_NS}><g id="F.SilkS"><rect x="10" width="10" height="10"/></g></svg>'
+    )
+    board_b = (
+        f'<svg {SVG_NS}><g id="F.SilkS"><rect x="50" width="10" height="10"/></g></svg>'
+    )
+
+    expected = write(convert_layers(board_a))
+
+    # Board A comes from the cache the second time around, and board B then
+    # replaces the cached layer before A is written.
+    cached = convert_layers(board_a)
+    convert_layers(board_b)
+
+    assert write(cached) == expected
+
+
+def test_drills_with_missing_attributes():
+    doc = _svg_document.SVGDocument(
+        text=f"""<svg {SVG_NS}><g id="Drills">
+            <circle cy="100" r="50"/>
+            <circle cx="100" cy="100"/>
+        </g></svg>""",
+        dpi=254,
+    )
+    converter = convert.Converter(doc, pcb.PCB(title="test"))
+    converter.convert_drills()
+
+    out = io.StringIO()
+    converter.pcb.write(out)
+    text = out.getvalue()
+
+    assert "nan" not in text
+    assert text.count("(footprint ") == 1
+    assert "(at 0.000000 10.000000)" in text
+
+
+def test_modified_document_is_not_used_from_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    text = (
+        f'<svg {SVG_NS}><g id="F.SilkS"><rect x="10" width="10" height="10"/></g></svg>'
+    )
+    outputs = []
+
+    for move in (False, True):
+        doc = _svg_document.SVGDocument(text=text)
+        # Changes made to the document after it's loaded have to count.
+        if move:
+            doc.etree[0][0].set("x", "50")
+
+        converter = convert.Converter(doc, pcb.PCB(title="test"))
+        converter.convert_layers()
+        out = io.StringIO()
+        converter.pcb.write(out)
+        outputs.append(_remove_timestamps(out.getvalue()))
+
+    assert outputs[0] != outputs[1]
+    assert "(xy 0.500000 0.000000)" in outputs[1]
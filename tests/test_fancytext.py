@@ -5,7 +5,7 @@
 import pytest
 
 from gingerbread import fancytext
-from .utils import compare_footprints, RESOURCES
+from .utils import _remove_timestamps, compare_footprints, RESOURCES
 
 
 @pytest.mark.parametrize(
@@ -38,7 +38,27 @@ from .utils import compare_footprints, RESOURCES
 def test_fancytext(filename, text, kwargs):
     fp = fancytext.generate(text=text, **kwargs)
 
-    if not (RESOURCES / filename).exists():
-        (RESOURCES / filename).write_text(fp)
+    # Only ever create missing reference files, never overwrite them, so that
+    # this is safe to run across pytest-xdist workers.
+    try:
+        with open(RESOURCES / filename, "x") as fh:
+            fh.write(fp)
+    except FileExistsError:
+        pass
 
     compare_footprints(RESOURCES / filename, fp)
+
+
+def test_generate_batch():
+    items = [
+        dict(text="Hello, World!"),
+        dict(text="Hello, World!", bold=True),
+        dict(text="Luke\nSkywalker", align="left"),
+    ]
+
+    fps = fancytext.generate_batch(items)
+
+    assert len(fps) == len(items)
+    for kwargs, fp in zip(items, fps):
+        expected = fancytext.generate(**kwargs)
+        assert _remove_timestamps(fp) == _remove_timestamps(expected)
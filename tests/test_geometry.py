@@ -0,0 +1,23 @@
+# Copyright (c) 2022 Alethea Katherine Flowers.
+# Published under the standard MIT License.
+# Full text available at: https://opensource.org/licenses/MIT
+
+import pytest
+import svgpathtools
+
+from gingerbread import _geometry
+
+
+@pytest.mark.parametrize(
+    "d",
+    [
+        "M 0 0 L 10 0 L 10 10 Z",
+        "M 0 0 C 0 100 100 100 100 0 Z",
+        "M 10 10 C -20 30 40 -50 60 20 L 60 40 C 90 90 0 30 10 10 Z",
+        "M 0 0 C 50 0 50 0 100 0 M 200 200 C 150 250 250 250 220 180 Z",
+    ],
+)
+def test_flatten_path_bbox_is_exact(d):
+    path = svgpathtools.parse_path(d)
+    _, bbox = _geometry.flatten_path(path, delta=10)
+    assert bbox == pytest.approx(path.bbox())
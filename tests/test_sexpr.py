@@ -0,0 +1,69 @@
+# Copyright (c) 2022 Alethea Katherine Flowers.
+# Published under the standard MIT License.
+# Full text available at: https://opensource.org/licenses/MIT
+
+import io
+
+import pytest
+
+from gingerbread import _sexpr as s
+
+from .utils import _remove_timestamps
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [
+        ("", '""'),
+        ("Hello, World!", '"Hello, World!"'),
+        ("F.SilkS", '"F.SilkS"'),
+        ("https://winterbloom.com", '"https://winterbloom.com"'),
+        ("{brace} <lt>", '"{brace} <lt>"'),
+        ('say "hi"', '"say \\"hi\\""'),
+        ("back\\slash", '"back\\\\slash"'),
+        ("line\nbreak", '"line\\nbreak"'),
+        ("carriage\rreturn", '"carriage\\rreturn"'),
+    ],
+)
+def test_escape_string(value, expected):
+    out = io.StringIO()
+    s.escape_string(value, out)
+    assert out.getvalue() == expected
+
+
+def test_symbol_escapes_string_attributes():
+    assert str(s.S("title", 'a "b"')) == '(title "a \\"b\\"")'
+
+
+def test_symbol_writes_attribute_subclasses():
+    class Number(float):
+        pass
+
+    assert str(s.S("at", Number(1.5), True, 2)) == "(at 1.500000 True 2)"
+
+
+def test_width_keeps_int_and_float_apart():
+    assert str(s.width(0)) == "(width 0)"
+    assert str(s.width(0.0)) == "(width 0.000000)"
+
+
+def test_setup_writes_pad_to_paste_clearance_ratio_once():
+    text = str(s.setup(pad_to_paste_clearance_ratio=-0.1))
+    assert text.count("pad_to_paste_clearance_ratio") == 1
+
+
+def test_xy_matches_symbol():
+    for x, y in [(1, 2), (1.5, -2.25)]:
+        expected = s.S("pts", s.S("xy", x, y), s.S("xy", x, y))
+        assert str(s.pts((x, y), s.xy(x, y))) == str(expected)
+        assert str(s.xy(x, y)) == str(s.S("xy", x, y))
+
+
+def test_points_match_xy():
+    coords = [1.0, 2.5, -3.25, 4.0, 0.1234567, 8.0]
+    pairs = list(zip(coords[::2], coords[1::2]))
+
+    assert str(s.pts(s.Points(coords))) == str(s.pts(*pairs))
+    assert _remove_timestamps(
+        str(s.fp_poly(pts=[s.Points(coords)], width=0))
+    ) == _remove_timestamps(str(s.fp_poly(pts=pairs, width=0)))
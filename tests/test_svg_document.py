@@ -0,0 +1,72 @@
+# Copyright (c) 2022 Alethea Katherine Flowers.
+# Published under the standard MIT License.
+# Full text available at: https://opensource.org/licenses/MIT
+
+import numpy as np
+import pytest
+
+from gingerbread import _svg_document
+
+SVG_NS = 'xmlns="http://www.w3.org/2000/svg"'
+
+
+@pytest.mark.parametrize(
+    ["style", "expected"],
+    [
+        ("fill:#ff0000;", "fill:black;"),
+        ("fill:orange;stroke:#eee;", "fill:black;stroke:blue;"),
+        ("stroke-width:2;fill:red", "stroke-width:2;fill:black"),
+        ("fill:none;stroke:none;", "fill:none;stroke:none;"),
+        ("fill-opacity:0.5;fill: white ;", "fill-opacity:0.5;fill:black;"),
+    ],
+)
+def test_recolor_style(style, expected):
+    doc = _svg_document.SVGDocument(text=f'<svg {SVG_NS}><rect style="{style}"/></svg>')
+    doc.recolor(fill="black", stroke="blue")
+    assert doc.etree[0].get("style") == expected
+
+
+def test_recolor_attributes():
+    doc = _svg_document.SVGDocument(
+        text=f'<svg {SVG_NS}><rect fill="white" stroke="red"/><rect fill="none"/></svg>'
+    )
+    doc.recolor()
+    assert dict(doc.etree[0].attrib) == {"fill": "black", "stroke": "black"}
+    assert dict(doc.etree[1].attrib) == {"fill": "none"}
+
+
+@pytest.mark.parametrize(
+    ["body", "expected"],
+    [
+        ('<rect width="1" height="1"/>', True),
+        ('<rect fill="#000" style="stroke:black"/>', True),
+        ('<rect fill="white"/>', False),
+        ('<rect style="fill:#ffffff"/>', False),
+        ('<rect fill="url(#gradient)"/>', False),
+        ("<style>rect { fill: white; }</style><rect/>", False),
+        ('<image href="knockout.png"/>', False),
+    ],
+)
+def test_is_all_black(body, expected):
+    doc = _svg_document.SVGDocument(text=f"<svg {SVG_NS}>{body}</svg>")
+    assert doc.is_all_black() == expected
+
+
+def test_recolor_makes_attribute_fills_black():
+    doc = _svg_document.SVGDocument(
+        text=f'<svg {SVG_NS}><rect fill="black"/><rect fill="white"/></svg>'
+    )
+    assert not doc.is_all_black()
+    doc.recolor()
+    assert doc.is_all_black()
+
+
+@pytest.mark.parametrize("dpi", [96, 254, 2540])
+def test_points_to_mm_array_matches_round(dpi):
+    doc = _svg_document.SVGDocument(text=f"<svg {SVG_NS}/>", dpi=dpi)
+    # Values with one decimal place land right next to a tie after scaling,
+    # where np.round and round() can disagree.
+    pts = np.arange(-20000, 20000).reshape(-1, 2) / 10
+
+    expected = [list(pt) for pt in doc.points_to_mm(pts.tolist())]
+    assert doc.points_to_mm_array(pts).tolist() == expected
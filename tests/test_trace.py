@@ -2,9 +2,11 @@
 # Published under the standard MIT License.
 # Full text available at: https://opensource.org/licenses/MIT
 
+import numpy as np
 import pytest
 
 from gingerbread import trace
+from gingerbread._cffi_deps import cairocffi
 from .utils import compare_footprints, RESOURCES
 
 
@@ -45,3 +47,21 @@ def test_black_and_white_squares_inverted():
     assert compare_footprints(
         RESOURCES / "black-white-squares-10x10mm-inverted.kicad_mod", fp
     )
+
+
+@pytest.mark.parametrize("invert", [False, True])
+def test_prepare_alpha_surface_matches_vips(invert):
+    # An odd width makes cairo pad the rows out past the image width.
+    surface = cairocffi.ImageSurface(cairocffi.FORMAT_A8, 13, 256)
+    data = np.ndarray(
+        shape=(256, surface.get_stride()), dtype=np.uint8, buffer=surface.get_data()
+    )
+    data[:] = np.arange(256, dtype=np.uint8)[:, np.newaxis]
+    surface.mark_dirty()
+
+    expected = trace._prepare_image(
+        trace._load_image(surface), invert=invert, threshold=127
+    )
+    result = trace._prepare_surface(surface, invert=invert, threshold=127)
+
+    assert np.array_equal(expected != 0, result)
@@ -6,12 +6,11 @@ import pathlib
 import re
 
 RESOURCES = pathlib.Path(__file__).parent / "resources"
+_TIMESTAMP_RE = re.compile(r"\((tstamp|tedit) \".+?\"\)")
 
 
 def _remove_timestamps(val: str) -> str:
-    val = re.sub(r"\(tstamp \".+?\"\)", '(tstamp "*")', val)
-    val = re.sub(r"\(tedit \".+?\"\)", '(tedit "*")', val)
-    return val
+    return _TIMESTAMP_RE.sub(r'(\1 "*")', val)
 
 
 def compare_footprints(ref: pathlib.Path, res: str) -> bool: